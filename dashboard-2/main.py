@@ -266,19 +266,12 @@ class Dashboard2(PPTXGenerator):
             chart = self.get_chart_by_title(chart_name) # get pie chart
             label_angle = math.radians(angle)
 
-            # delete all numbers on pie chart
-            numCache = chart.xpath('//c:numCache')[0]
-            ptCount = chart.xpath('.//c:ptCount', numCache)[0]
-            ptCount.set('val', str(len(values)))
-            for e in chart.xpath('.//c:pt', numCache):
-                remove(e)
-
-            # delete all strings on pie chart
-            strCache = chart.xpath('//c:cat/c:strRef/c:strCache')[0]
-            ptCount = chart.xpath('.//c:ptCount', strCache)[0]
-            ptCount.set('val', str(len(values)))
-            for e in chart.xpath('.//c:pt', strCache):
-                remove(e)
+            # replace numbers and strings on pie chart
+            chart.fill_series(
+                [self.format_float(row[2]/10.**6, prec=0) for row in values],
+                0,
+                categories=[row[0] for row in values],
+            )
 
             ser = chart.xpath('//c:ser')[0]
             for e in chart.xpath('.//c:dPt', ser):
@@ -296,16 +289,6 @@ class Dashboard2(PPTXGenerator):
             c = ((coords[2]+coords[0])*.5, (coords[3]+coords[1])*.5)
 
             for i, row in enumerate(values):
-                pt = etree.SubElement(strCache, '{%s}pt' % chart.NS['c'])
-                pt.set('idx', str(i))
-                v = etree.SubElement(pt, '{%s}v' % chart.NS['c'])
-                v.text = row[0]
-
-                pt = etree.SubElement(numCache, '{%s}pt' % chart.NS['c'])
-                pt.set('idx', str(i))
-                v = etree.SubElement(pt, '{%s}v' % chart.NS['c'])
-                v.text = self.format_float(row[2]/10.**6, prec=0)
-
                 dPt = etree.SubElement(ser, '{%s}dPt' % chart.NS['c'])
                 etree.SubElement(dPt, '{%s}idx' % chart.NS['c']).set('val', str(i))
                 spPr = etree.SubElement(dPt, '{%s}spPr' % chart.NS['c'])
@@ -83,10 +83,7 @@ class Dashboard4(PPTXGenerator):
         # fill bottom chart with values
         self.fill_chart(
             2,
-            [
-                [self.get_cell(name) for name in C('B%s' % c, 'Z%s' % c)]
-                for c in range(19, 23)
-            ],
+            self.get_range(C('B19', 'Z22')),
             conv=to_zero,
         )
 
@@ -5,43 +5,396 @@ Module for generating PPTX files from templates and excel files.
 
 from __future__ import division, unicode_literals
 
+import array
+import collections
 import copy
-import distutils.dir_util
+import fnmatch
+import hashlib
+import inspect
+import io
 import itertools
+import json
+import multiprocessing
 import os
+import posixpath
 import shutil
+import struct
 import sys
 import tempfile
+import time
+import traceback
 import warnings
 import zipfile
+import zlib
+from multiprocessing.pool import ThreadPool
+
+from xml.sax.saxutils import escape as xml_escape
 
 from lxml import etree
 import xlrd
+from xlrd.xlsx import unescape as unescape_xlsx
+
+# timestamp of all written zip members, earliest one zip format supports
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+
+def get_rels_name(name):
+    """ Returns name of part's relationships part.
+    :param name: part name (ppt/slides/slide1.xml)
+    :return: relationships part name (ppt/slides/_rels/slide1.xml.rels)
+    """
+    head, tail = posixpath.split(name)
+    return posixpath.join(head, '_rels', '%s.rels' % tail)
+
+
+def resolve_target(name, target):
+    """ Resolves relationship target against the part it belongs to.
+    :param name: source part name
+    :param target: relationship target
+    :return: target part name
+    """
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(name), target))
+
+
+def get_zip_info(name, compress_type=zipfile.ZIP_DEFLATED):
+    """ Returns ZipInfo of member with fixed timestamp, so equal parts give equal archives.
+    :param name: member name
+    :param compress_type: compression method
+    :return: ZipInfo
+    """
+    zinfo = zipfile.ZipInfo(name, ZIP_DATE_TIME)
+    zinfo.compress_type = compress_type
+    zinfo.external_attr = 0o600 << 16
+    return zinfo
+
+
+def get_member_order(names):
+    """ Returns names in canonical order of archive members.
+    :param names: member names
+    :return: list of names, [Content_Types].xml first, then sorted
+    """
+    return sorted(names, key=lambda name: (name != '[Content_Types].xml', name))
+
+
+def read_raw_member(fp, info):
+    """ Reads compressed bytes of zip member as they are stored in archive.
+    :param fp: zip file object
+    :param info: member's ZipInfo
+    :return: compressed bytes
+    """
+    fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader, fp.read(zipfile.sizeFileHeader))
+    fp.seek(header[zipfile._FH_FILENAME_LENGTH]+header[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+    return fp.read(info.compress_size)
 
 
-def zip_pres_dir(src_dir, dst):
-    """ Zipes ooxml directory to zip.
-    :param src_dir: dir to zip
-    :param dst: dir where to save
+def inflate_raw_member(info, data):
+    """ Decompresses bytes read by read_raw_member.
+    :param info: member's ZipInfo
+    :param data: compressed bytes
+    :return: member bytes
     """
-    zf = zipfile.ZipFile(dst, "w", zipfile.ZIP_DEFLATED)
-    for root, dirs, files in os.walk(src_dir):
-        for filename in files:
-            full_path = os.path.join(root, filename)
-            zf.write(full_path, os.path.relpath(full_path, src_dir))
-    zf.close()
+    if info.compress_type == zipfile.ZIP_DEFLATED:
+        data = zlib.decompress(data, -15)
+    elif info.compress_type != zipfile.ZIP_STORED:
+        raise zipfile.BadZipfile('Unsupported compression method %s for %s.' % (info.compress_type, info.filename))
+    if zlib.crc32(data) & 0xffffffff != info.CRC:
+        raise zipfile.BadZipfile('Bad CRC-32 for file %s.' % info.filename)
+    return data
+
+
+def write_raw_member(zf, info, data, arcname=None):
+    """ Writes already compressed member to zip without recompressing it.
+    :param zf: ZipFile opened for writing
+    :param info: member's ZipInfo from source archive
+    :param data: compressed bytes
+    :param arcname: member name in zip, by default name from source archive
+    """
+    zinfo = get_zip_info(arcname or info.filename, info.compress_type)
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    zinfo.header_offset = zf.fp.tell()
+    zf._writecheck(zinfo)
+    zf._didModify = True
+    zf.fp.write(zinfo.FileHeader())
+    zf.fp.write(data)
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+
+
+class Package(object):
+    """
+    In-memory ooxml package, maps part names to part bytes.
+
+    Parts which weren't modified since reading keep their compressed bytes
+    and are copied to the output as is. Pristine parsed trees may be kept for
+    xml parts, parsing such part returns copy of the tree. Modified trees are
+    registered as dirty and serialized once, when the part is read or saved.
+    """
+
+    def __init__(self, parts=None, raw=None, trees=None):
+        self.parts = collections.OrderedDict(parts or ())
+        self.raw = dict(raw or ())
+        self.trees = dict(trees or ())
+        self.dirty = {}
+
+    @classmethod
+    def open(cls, src):
+        """ Reads all parts of ooxml file into memory.
+        :param src: ooxml file or file-like object to read
+        :return: package
+        """
+        parts = []
+        raw = {}
+        fp = open(src, 'rb') if isinstance(src, basestring) else src
+        try:
+            zfile = zipfile.ZipFile(fp)
+            for info in zfile.infolist():
+                if info.filename.endswith('/'):
+                    continue
+                parts.append((info.filename, None))
+                raw[info.filename] = (info, read_raw_member(fp, info))
+        finally:
+            if fp is not src:
+                fp.close()
+        return cls(parts, raw)
+
+    def __contains__(self, name):
+        return name in self.parts
+
+    def __iter__(self):
+        return iter(self.parts)
+
+    def read(self, name):
+        """ Returns part bytes.
+        :param name: part name
+        :return: part bytes
+        """
+        if name in self.dirty:
+            self.parts[name] = etree.tostring(self.dirty.pop(name))
+        data = self.parts[name]
+        if data is None:
+            data = self.parts[name] = inflate_raw_member(*self.raw[name])
+        return data
+
+    def write(self, name, data):
+        """ Sets part bytes, adds part if it doesn't exist.
+        :param name: part name
+        :param data: part bytes
+        """
+        self.parts[name] = data
+        self.raw.pop(name, None)
+        self.trees.pop(name, None)
+        self.dirty.pop(name, None)
+
+    def mark_dirty(self, name, tree):
+        """ Registers modified tree of part, adds part if it doesn't exist.
+
+        Tree is serialized once when part is read or package is saved, so
+        marking it several times costs nothing.
+        :param name: part name
+        :param tree: xml tree
+        """
+        self.parts.setdefault(name, None)
+        self.raw.pop(name, None)
+        self.trees.pop(name, None)
+        self.dirty[name] = tree
+
+    def flush(self):
+        """ Serializes all dirty trees. """
+        for name in list(self.dirty):
+            self.read(name)
+
+    def parse(self, name):
+        """ Parses xml part.
+        :param name: part name
+        :return: xml tree
+        """
+        tree = self.trees.get(name)
+        if tree is not None:
+            return copy.deepcopy(tree)
+        return etree.ElementTree(etree.fromstring(self.read(name)))
+
+    def keep_tree(self, name):
+        """ Parses xml part once and keeps the tree for further parsing.
+        :param name: part name
+        """
+        if name not in self.trees:
+            self.trees[name] = self.parse(name)
+
+    def serialize(self, name, tree):
+        """ Serializes xml tree to part.
+        :param name: part name
+        :param tree: xml tree
+        """
+        self.write(name, etree.tostring(tree))
+
+    def copy(self):
+        """ Returns package copy, part bytes and pristine trees are shared.
+        :return: package
+        """
+        self.flush()
+        return self.__class__(self.parts, self.raw, self.trees)
+
+    def get_reachable(self):
+        """ Returns names of parts reachable by relationships from package root.
+        :return: set of part names
+        """
+        names = {'[Content_Types].xml'}
+        sources = ['']
+        while sources:
+            source = sources.pop()
+            rels_name = get_rels_name(source)
+            if rels_name not in self.parts:
+                continue
+            names.add(rels_name)
+            for r in self.parse(rels_name).getroot():
+                if r.get('TargetMode') == 'External':
+                    continue
+                name = resolve_target(source, r.get('Target'))
+                if name in self.parts and name not in names:
+                    names.add(name)
+                    sources.append(name)
+        return names
+
+    def prune(self):
+        """ Removes parts which aren't reachable from package root and their content types. """
+        reachable = self.get_reachable()
+        removed = {name for name in self.parts if name not in reachable}
+        if not removed:
+            return
+
+        for name in removed:
+            del self.parts[name]
+            self.raw.pop(name, None)
+            self.trees.pop(name, None)
+            self.dirty.pop(name, None)
+
+        content_types = self.parse('[Content_Types].xml')
+        for e in list(content_types.getroot().iter(tag='{*}Override')):
+            if e.get('PartName').lstrip('/') in removed:
+                remove(e)
+        self.serialize('[Content_Types].xml', content_types)
+
+    def get_size(self):
+        """ Returns approximate memory taken by package.
+        :return: size in bytes
+        """
+        return (
+            sum(len(data) for info, data in self.raw.values()) +
+            sum(len(data) for data in self.parts.values() if data is not None)
+        )
+
+    def save(self, dst):
+        """ Zips package, only modified parts are compressed.
+
+        Members are written in canonical order with fixed timestamps, so
+        packages with equal parts are saved byte-identical.
+        :param dst: file where to save
+        """
+        self.flush()
+        zf = zipfile.ZipFile(dst, "w", zipfile.ZIP_DEFLATED)
+        try:
+            for name in get_member_order(self.parts):
+                self.write_to(zf, name)
+        finally:
+            zf.close()
 
+    def write_to(self, zf, name, arcname=None):
+        """ Writes part to zip, unmodified parts aren't recompressed.
+        :param zf: ZipFile opened for writing
+        :param name: part name
+        :param arcname: member name in zip, by default part name
+        """
+        if name in self.raw:
+            write_raw_member(zf, *self.raw[name], arcname=arcname)
+        else:
+            zf.writestr(get_zip_info(arcname or name), self.read(name))
 
-def unzip_pres(src):
-    """ Unzipes template.pptx.
-    :param src: .pptx template to unzip
-    :return: path to directory with office xml files
+
+class TemplateCache(object):
     """
-    tmp_dir = tempfile.mkdtemp()
-    zfile = zipfile.ZipFile(src)
-    zfile.extractall(tmp_dir)
-    zfile.close()
-    return tmp_dir
+    Process-level LRU cache of template packages.
+
+    Templates are keyed by path, modification time and size. Slide, chart and
+    presentation parts are kept parsed, each run gets a cheap package copy.
+    Fill plans compiled for the template are kept and evicted with it.
+    """
+
+    parsed_parts = ('ppt/presentation.xml', 'ppt/slides/*.xml', 'ppt/charts/*.xml')
+
+    def __init__(self, max_entries=16, max_size=256*1024*1024):
+        """ Initialize cache.
+        :param max_entries: maximum number of cached templates
+        :param max_size: maximum approximate memory taken by cached templates
+        """
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+
+    def get_key(self, path):
+        """ Returns cache key for template.
+        :param path: template path
+        :return: cache key
+        """
+        st = os.stat(path)
+        return os.path.abspath(path), st.st_mtime, st.st_size
+
+    def get(self, path):
+        """ Returns copy of template package, loads template if needed.
+        :param path: template path
+        :return: package
+        """
+        return self.get_entry(path)[0].copy()
+
+    def get_plans(self, path):
+        """ Returns fill plans compiled for template, loads template if needed.
+        :param path: template path
+        :return: dictionary of plans
+        """
+        return self.get_entry(path)[2]
+
+    def get_entry(self, path):
+        """ Returns cache entry of template, loads template if needed.
+        :param path: template path
+        :return: (package, size, plans)
+        """
+        key = self.get_key(path)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            entry = self.load(path)
+        self.entries[key] = entry
+        self.evict()
+        return entry
+
+    def load(self, path):
+        """ Reads template and parses its main parts.
+        :param path: template path
+        :return: (package, size, plans)
+        """
+        package = Package.open(path)
+        for name in package:
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in self.parsed_parts):
+                package.keep_tree(name)
+        return package, package.get_size(), {}
+
+    def evict(self):
+        """ Removes least recently used templates above the limits, the most recent is always kept. """
+        while len(self.entries) > 1 and (
+            len(self.entries) > self.max_entries or
+            sum(size for package, size, plans in self.entries.values()) > self.max_size
+        ):
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """ Removes all cached templates. """
+        self.entries.clear()
+
+
+template_cache = TemplateCache()
 
 
 def C(start, end=None):
@@ -87,6 +440,38 @@ def get_indices_from_name(name):
     return row-1, col-1
 
 
+def get_formula_cells(formula, count=None):
+    """ Returns sheet name and cells of chart's range reference.
+    :param formula: range reference ('Sheet 1'!$B$2:$B$9 etc)
+    :param count: number of cells, by default number of cells in reference
+    :return: sheet name, list of cell indexes
+    """
+    sheet, ref = formula.rsplit('!', 1)
+    if sheet.startswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    names = ref.replace('$', '').split(':')
+    start = get_indices_from_name(names[0])
+    end = get_indices_from_name(names[-1])
+    horizontal = start[0] == end[0] and start[1] != end[1]
+    if count is None:
+        count = (end[1]-start[1] if horizontal else end[0]-start[0])+1
+    return sheet, [(start[0], start[1]+i) if horizontal else (start[0]+i, start[1]) for i in range(count)]
+
+
+def get_range_formula(sheet, cells):
+    """ Returns range reference of cells.
+    :param sheet: sheet name
+    :param cells: cell indexes from first to last
+    :return: range reference ('Sheet 1'!$B$2:$B$9 etc)
+    """
+    if not all(ch.isalnum() or ch == '_' for ch in sheet):
+        sheet = "'%s'" % sheet.replace("'", "''")
+    ref = xlrd.cellnameabs(*cells[0])
+    if len(cells) > 1:
+        ref += ':%s' % xlrd.cellnameabs(*cells[-1])
+    return '%s!%s' % (sheet, ref)
+
+
 def alpha_range(start, stop):
     """ Returns chars between start char and stop char(A,D -> A,B,C,D).
     :param start: start char
@@ -96,6 +481,30 @@ def alpha_range(start, stop):
     return [chr(x) for x in range(ord(start), ord(stop)+1)]
 
 
+def get_element_path(e):
+    """ Returns path of element as indexes of its ancestors' children.
+    :param e: xml element
+    :return: tuple of indexes from root
+    """
+    path = []
+    parent = e.getparent()
+    while parent is not None:
+        path.append(parent.index(e))
+        e, parent = parent, parent.getparent()
+    return tuple(reversed(path))
+
+
+def get_element_by_path(root, path):
+    """ Returns element by path from get_element_path.
+    :param root: root element
+    :param path: tuple of indexes
+    :return: xml element
+    """
+    for index in path:
+        root = root[index]
+    return root
+
+
 def remove(e):
     ''' Removes parent element from xml.
     :param e: ooxml element
@@ -113,6 +522,407 @@ def get_or_create_child(parent, name):
     return e if e is not None else etree.SubElement(parent, name)
 
 
+def get_xlsx_text(e):
+    """ Returns text of xlsx element the way xlrd does.
+    :param e: t or v element
+    :return: unicode text
+    """
+    text = e.text or ''
+    if e.get('{http://www.w3.org/XML/1998/namespace}space') != 'preserve':
+        text = text.strip('\t\n \r')
+    return unescape_xlsx(unicode(text))
+
+
+def get_xlsx_string(e):
+    """ Returns text of shared or inline string the way xlrd does.
+    :param e: si or is element
+    :return: unicode text
+    """
+    s = '{%s}' % XLSXBook.NS['s']
+    texts = []
+    for child in e:
+        if child.tag == s+'t':
+            texts.append(get_xlsx_text(child))
+        elif child.tag == s+'r':
+            texts.extend(get_xlsx_text(t) for t in child.iterfind(s+'t'))
+    return ''.join(texts)
+
+
+class XLSXBook(object):
+    """
+    Streaming reader of .xlsx workbooks, a replacement of xlrd workbook.
+
+    Sheets are parsed on first request, only shared strings the sheet refers
+    to are kept. Cell values are the same as xlrd gives.
+    """
+
+    NS = {
+        's': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+        'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    }
+    error_codes = {text: code for code, text in xlrd.error_text_from_code.items()}
+
+    def __init__(self, src):
+        """ Reads list of sheets.
+        :param src: .xlsx file or file-like object
+        """
+        self.src = src
+        self.sheets = {}
+        self.shared_strings = {}
+        with self.open() as zf:
+            self.workbook_name = next(
+                resolve_target('', r.get('Target')) for r in etree.fromstring(zf.read('_rels/.rels'))
+                if r.get('Type').endswith('/officeDocument')
+            )
+            rels = etree.fromstring(zf.read(get_rels_name(self.workbook_name)))
+            targets = {r.get('Id'): resolve_target(self.workbook_name, r.get('Target')) for r in rels}
+            self.shared_strings_name = next(
+                (resolve_target(self.workbook_name, r.get('Target')) for r in rels
+                 if r.get('Type').endswith('/sharedStrings')),
+                None,
+            )
+            self.sheet_parts = [
+                (e.get('name'), targets[e.get('{%s}id' % self.NS['r'])])
+                for e in etree.fromstring(zf.read(self.workbook_name)).iter('{%s}sheet' % self.NS['s'])
+            ]
+
+    def open(self):
+        """ Opens workbook archive, file is reopened every time so forked processes don't share its offset.
+        :return: ZipFile
+        """
+        if not isinstance(self.src, basestring):
+            self.src.seek(0)
+        return zipfile.ZipFile(self.src)
+
+    def sheet_names(self):
+        """ Returns names of sheets.
+        :return: list of names
+        """
+        return [name for name, part in self.sheet_parts]
+
+    def sheet_by_index(self, index):
+        """ Returns sheet by its position.
+        :param index: sheet index
+        :return: XLSXSheet
+        """
+        name, part = self.sheet_parts[index]
+        if name not in self.sheets:
+            self.sheets[name] = self.read_sheet(name, part)
+        return self.sheets[name]
+
+    def sheet_by_name(self, name):
+        """ Returns sheet by its name.
+        :param name: sheet name
+        :return: XLSXSheet
+        """
+        names = self.sheet_names()
+        if name not in names:
+            raise xlrd.XLRDError('No sheet named <%r>' % name)
+        return self.sheet_by_index(names.index(name))
+
+    def unload_sheet(self, sheet_name_or_index):
+        """ Frees parsed sheet, it's parsed again on next request.
+        :param sheet_name_or_index: sheet name or index
+        """
+        if not isinstance(sheet_name_or_index, basestring):
+            sheet_name_or_index = self.sheet_parts[sheet_name_or_index][0]
+        self.sheets.pop(sheet_name_or_index, None)
+
+    def read_sheet(self, name, part):
+        """ Parses sheet xml.
+        :param name: sheet name
+        :param part: sheet part name
+        :return: XLSXSheet
+        """
+        s = '{%s}' % self.NS['s']
+        sheet = XLSXSheet(name)
+        cells = sheet.cells
+        string_cells = []
+        columns = {}
+        last_row = -1
+        col_index = -1
+        with self.open() as zf:
+            for event, e in etree.iterparse(zf.open(part), tag=(s+'c', s+'row', s+'mergeCell')):
+                if e.tag == s+'row':
+                    last_row = int(e.get('r'))-1 if e.get('r') else last_row+1
+                    col_index = -1
+                    e.clear()
+                    while e.getprevious() is not None:
+                        del e.getparent()[0]
+                    continue
+                if e.tag == s+'mergeCell':
+                    ref = e.get('ref')
+                    last_row_index, last_col_index = get_indices_from_name(ref.split(':')[-1].replace('$', ''))
+                    sheet.nrows = max(sheet.nrows, last_row_index+1)
+                    sheet.ncols = max(sheet.ncols, last_col_index+1)
+                    continue
+
+                r = e.get('r')
+                if r is None:
+                    row = e.getparent().get('r')
+                    row_index = int(row)-1 if row else last_row+1
+                    col_index += 1
+                elif not len(e):
+                    # blank cell, most of them are only styled
+                    continue
+                else:
+                    letters = r.rstrip('0123456789')
+                    row_index = int(r[len(letters):])-1
+                    if letters not in columns:
+                        columns[letters] = col_to_num(letters.replace('$', ''))-1
+                    col_index = columns[letters]
+
+                cell_type = e.get('t', 'n')
+                v = e.find(s+'v')
+                text = v.text if v is not None else None
+                if cell_type == 'n':
+                    if text:
+                        cells[row_index, col_index] = float(text)
+                elif cell_type == 's':
+                    if text:
+                        string_cells.append((row_index, col_index, int(text)))
+                elif cell_type == 'str':
+                    cells[row_index, col_index] = get_xlsx_text(v) if v is not None else None
+                elif cell_type == 'b':
+                    cells[row_index, col_index] = int(text)
+                elif cell_type == 'e':
+                    cells[row_index, col_index] = self.error_codes[text]
+                elif cell_type == 'inlineStr':
+                    cells[row_index, col_index] = get_xlsx_string(e.find(s+'is'))
+                else:
+                    raise ValueError('Unknown cell type %r of cell %s in sheet %r.' % (cell_type, r, name))
+
+        indexes = {index for row, col, index in string_cells}
+        self.load_shared_strings(indexes)
+        for row, col, index in string_cells:
+            cells[row, col] = self.shared_strings[index]
+        if cells:
+            sheet.nrows = max(sheet.nrows, max(row for row, col in cells)+1)
+            sheet.ncols = max(sheet.ncols, max(col for row, col in cells)+1)
+        return sheet
+
+    def load_shared_strings(self, indexes):
+        """ Reads shared strings with given indexes which weren't read yet.
+        :param indexes: set of string indexes
+        """
+        missing = {index for index in indexes if index not in self.shared_strings}
+        if not missing:
+            return
+        last = max(missing)
+        with self.open() as zf:
+            for index, (event, e) in enumerate(etree.iterparse(
+                zf.open(self.shared_strings_name),
+                tag='{%s}si' % self.NS['s'],
+            )):
+                if index in missing:
+                    self.shared_strings[index] = get_xlsx_string(e)
+                e.clear()
+                while e.getprevious() is not None:
+                    del e.getparent()[0]
+                if index == last:
+                    break
+
+
+class XLSXSheet(object):
+    """
+    Values of one sheet read by XLSXBook, rows are padded with empty strings like in xlrd.
+    """
+
+    # xlrd pads rows with byte strings
+    empty_value = b''
+
+    def __init__(self, name):
+        self.name = name
+        self.nrows = 0
+        self.ncols = 0
+        self.cells = {}
+
+    def cell_value(self, row, col):
+        """ Returns cell value.
+        :param row: row index
+        :param col: column index
+        :return: cell value
+        """
+        if not (0 <= row < self.nrows and 0 <= col < self.ncols):
+            raise IndexError('Cell (%s, %s) is out of sheet %r.' % (row, col, self.name))
+        return self.cells.get((row, col), self.empty_value)
+
+    def col_values(self, col):
+        """ Returns column values.
+        :param col: column index
+        :return: list of values
+        """
+        return [self.cells.get((row, col), self.empty_value) for row in range(self.nrows)]
+
+    def row_values(self, row):
+        """ Returns row values.
+        :param row: row index
+        :return: list of values
+        """
+        return [self.cells.get((row, col), self.empty_value) for col in range(self.ncols)]
+
+
+def open_workbook(src):
+    """ Opens workbook, sheets are loaded when they are requested.
+
+    .xlsx files are read by XLSXBook and other formats by xlrd.
+    :param src: excel file or file-like object
+    :return: workbook
+    """
+    if zipfile.is_zipfile(src):
+        return XLSXBook(src)
+    if isinstance(src, basestring):
+        return xlrd.open_workbook(src, on_demand=True)
+    src.seek(0)
+    return xlrd.open_workbook(file_contents=src.read(), on_demand=True)
+
+
+class SheetSnapshot(object):
+    """
+    Compact column-wise copy of worksheet values.
+
+    Columns containing only numbers are stored in float arrays.
+    """
+
+    def __init__(self, worksheet):
+        """ Initialize with worksheet.
+        :param worksheet: xlrd worksheet or XLSXSheet
+        """
+        self.nrows = worksheet.nrows
+        self.ncols = worksheet.ncols
+        self.columns = []
+        for col in range(self.ncols):
+            values = worksheet.col_values(col)
+            if all(type(v) is float for v in values):
+                values = array.array(b'd', values)
+            self.columns.append(values)
+
+    def get(self, row, col):
+        """ Returns cell value.
+        :param row: row index
+        :param col: column index
+        :return: cell value
+        """
+        return self.columns[col][row]
+
+    def get_digest(self):
+        """ Returns hash of all sheet values.
+        :return: hex digest
+        """
+        digest = hashlib.sha1(repr((self.nrows, self.ncols)).encode('utf-8'))
+        for values in self.columns:
+            digest.update(values.tostring() if isinstance(values, array.array) else repr(values).encode('utf-8'))
+        return digest.hexdigest()
+
+
+class OutputCache(object):
+    """
+    On-disk cache of rendered presentations keyed by hash of render inputs.
+
+    Every entry is a directory with output.pptx, separate charts and cells
+    read during render. Least recently used entries are removed when cache
+    grows over max_size.
+    """
+
+    def __init__(self, cache_dir=None, max_size=512*1024*1024):
+        """ Initialize cache.
+        :param cache_dir: cache directory, by default ~/.cache/data2ppt
+        :param max_size: maximum size of cached files in bytes
+        """
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser('~'), '.cache', 'data2ppt')
+        self.max_size = max_size
+
+    def get(self, key, outputs):
+        """ Copies cached files to their destinations.
+        :param key: cache key
+        :param outputs: list of (name in cache entry, destination path)
+        :return: cells read during cached render or None if there is no such complete entry
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry_dir, 'cells.json')) as f:
+                cells = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if not all(os.path.isfile(os.path.join(entry_dir, name)) for name, dst in outputs):
+            # incomplete entry is removed so that put can replace it after render
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        try:
+            for name, dst in outputs:
+                dst_dir = os.path.dirname(dst)
+                if dst_dir and not os.path.isdir(dst_dir):
+                    os.makedirs(dst_dir)
+                shutil.copyfile(os.path.join(entry_dir, name), dst)
+            os.utime(entry_dir, None)
+        except (IOError, OSError):
+            return None
+        return cells
+
+    def put(self, key, outputs, cells):
+        """ Adds rendered files to cache.
+        :param key: cache key
+        :param outputs: list of (name in cache entry, rendered file path)
+        :param cells: cells read during render
+        """
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp')
+        try:
+            for name, src in outputs:
+                path = os.path.join(tmp_dir, name)
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                shutil.copyfile(src, path)
+            with open(os.path.join(tmp_dir, 'cells.json'), 'w') as f:
+                json.dump(cells, f)
+            os.rename(tmp_dir, os.path.join(self.cache_dir, key))
+        except OSError:
+            pass
+        finally:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir)
+
+        self.evict()
+
+    def evict(self):
+        """ Removes least recently used entries until cache fits max_size. """
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, key)
+            if key.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            size = sum(
+                os.path.getsize(os.path.join(root, name))
+                for root, dirs, files in os.walk(entry_dir) for name in files
+            )
+            entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+
+        total = sum(size for mtime, size, entry_dir in entries)
+        for mtime, size, entry_dir in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+
+def get_cells_digest(sheet, cells):
+    """ Returns hash of cell values.
+    :param sheet: sheet snapshot
+    :param cells: excel cell names
+    :return: hex digest or None if some cell is out of sheet
+    """
+    values = []
+    for name in cells:
+        try:
+            values.append(sheet.get(*get_indices_from_name(name)))
+        except IndexError:
+            return None
+    return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()
+
+
 class XMLModifier(object):
     """
     Class helper to modify ooxml documents.
@@ -126,28 +936,42 @@ class XMLModifier(object):
         'p': 'http://schemas.openxmlformats.org/presentationml/2006/main',
     }
 
-    def __init__(self, xml_file):
+    xpath_cache = {}
+
+    def __init__(self, xml_file, package=None):
         """ Initialize with ooxml file.
-        :param xml_file: ooxml file
+        :param xml_file: ooxml file or part name if package is specified
+        :param package: package containing the part, by default None
         """
         self.xml_file = xml_file
-        self.tree = etree.parse(xml_file)
+        self.package = package
+        self.tree = etree.parse(xml_file) if package is None else package.parse(xml_file)
 
-    def xpath(self, xpath, e=None, error=True):
+    def xpath(self, xpath, e=None, error=True, **variables):
         """ Returns element via it's xpath.
-        :param xpath: element's xpath
+        :param xpath: element's xpath, compiled once and cached
         :param e: ooxml element
         :param error: errors by default
+        :param variables: values of xpath variables ($title etc)
         :return: xml elemet
         """
-        elements = (self.tree if e is None else e).xpath(xpath, namespaces=self.NS)
+        compiled = self.xpath_cache.get(xpath)
+        if compiled is None:
+            compiled = self.xpath_cache[xpath] = etree.XPath(xpath, namespaces=self.NS)
+        elements = compiled(self.tree if e is None else e, **variables)
         if not elements and error:
-            raise ValueError('There is no elements for this XPath %s.' % xpath)
+            raise ValueError('There is no elements for this XPath %s%s.' % (
+                xpath,
+                ' with %s' % variables if variables else '',
+            ))
         return elements
 
     def write(self):
-        """ Writes changes to xml. """
-        self.tree.write(self.xml_file)
+        """ Writes changes to xml, in package tree is serialized when package is saved. """
+        if self.package is None:
+            self.tree.write(self.xml_file)
+        else:
+            self.package.mark_dirty(self.xml_file, self.tree)
 
 
 class ChartFiller(XMLModifier):
@@ -155,31 +979,31 @@ class ChartFiller(XMLModifier):
     Class fills xml files
     """
     def __init__(self, generator, path):
-        super(ChartFiller, self).__init__(path)
+        super(ChartFiller, self).__init__(path, generator.package)
         self.generator = generator
+        self.series = None
+        self.workbook_values = []
 
-    def fill_data(self, data, conv=None):
+    def fill_data(self, data, conv=None, categories=None, format_code=None):
         """ Fills template from excel data.
         :param data: excel data
+        :param categories: category names of every series, by default categories are kept
+        :param format_code: number format of values, by default format is kept
         """
         for ser_index, ser_data in enumerate(data):
-            self.fill_series(ser_data, ser_index, conv=conv)
+            self.fill_series(ser_data, ser_index, conv=conv, categories=categories, format_code=format_code)
 
-    def fill_series(self, data, n, conv=None):
+    def fill_series(self, data, n, conv=None, categories=None, format_code=None):
         """ Fills template from excel values.
         :param data: excel values
         :param n: numbers
+        :param categories: category names, by default categories are kept
+        :param format_code: number format of values, by default format is kept
         """
-        numCache = self.xpath('//c:ser[c:idx[@val="%s"]]//c:numCache' % n)[0]
-        for e in self.xpath('c:pt', numCache):
-            remove(e)
-        for pt_index, pt_val in enumerate(data):
-            if conv:
-                pt_val = conv(pt_val)
-            pt_e = etree.SubElement(numCache, '{%s}pt' % self.NS['c'])
-            pt_e.set('idx', str(pt_index))
-            val_e = etree.SubElement(pt_e, '{%s}v' % self.NS['c'])
-            val_e.text = str(pt_val)
+        ser = self.get_series(n)
+        self.fill_cache(self.xpath('c:val//c:numCache|c:yVal//c:numCache', ser)[0], data, conv, format_code)
+        if categories is not None:
+            self.fill_cache(self.xpath('c:cat//c:strCache|c:cat//c:numCache', ser)[0], categories)
 
     def fill_from_cells(self, cells, conv=None):
         """ Fills chart with values from excel.
@@ -191,6 +1015,88 @@ class ChartFiller(XMLModifier):
         ]
         self.fill_data(data, conv=conv)
 
+    def get_series(self, n):
+        """ Returns series element, series are indexed once.
+        :param n: series index
+        :return: c:ser element
+        """
+        if self.series is None:
+            self.series = {
+                int(self.xpath('c:idx', ser)[0].get('val')): ser for ser in self.xpath('//c:ser', error=False)
+            }
+        if n not in self.series:
+            raise ValueError('There is no series %s in chart %s.' % (n, self.xml_file))
+        return self.series[n]
+
+    def fill_cache(self, cache, values, conv=None, format_code=None):
+        """ Replaces points of c:numCache or c:strCache at once.
+        :param cache: cache element
+        :param values: point values, list or array
+        :param conv: values converter
+        :param format_code: number format of values, by default format is kept
+        """
+        c = self.NS['c']
+        if conv:
+            values = [conv(v) for v in values]
+        points = etree.fromstring('<c:cache xmlns:c="%s">%s</c:cache>' % (c, ''.join(
+            '<c:pt idx="%s"><c:v>%s</c:v></c:pt>' % (i, xml_escape('%s' % v)) for i, v in enumerate(values)
+        )))
+
+        for e in cache.findall('{%s}pt' % c):
+            cache.remove(e)
+        f = cache.getparent().find('{%s}f' % c)
+        if f is not None and values:
+            # cells of template range which aren't filled anymore are cleared
+            sheet, template_cells = get_formula_cells(f.text)
+            filled_cells = get_formula_cells(f.text, len(values))[1]
+            f.text = get_range_formula(sheet, filled_cells)
+            cells = max(template_cells, filled_cells, key=len)
+            self.workbook_values.append((
+                sheet,
+                template_cells,
+                filled_cells,
+                list(values)+[None]*(len(cells)-len(values)),
+                cache.tag == '{%s}numCache' % c,
+            ))
+
+        formatCode = cache.find('{%s}formatCode' % c)
+        if format_code is not None and cache.tag == '{%s}numCache' % c:
+            if formatCode is None:
+                formatCode = etree.Element('{%s}formatCode' % c)
+                cache.insert(0, formatCode)
+            formatCode.text = format_code
+        ptCount = cache.find('{%s}ptCount' % c)
+        if ptCount is None:
+            ptCount = etree.Element('{%s}ptCount' % c)
+            cache.insert(int(formatCode is not None), ptCount)
+        ptCount.set('val', str(len(values)))
+        index = cache.index(ptCount)+1
+        cache[index:index] = list(points)
+
+    def write(self):
+        """ Writes changes to xml, filled values are written to embedded workbook too. """
+        super(ChartFiller, self).write()
+        if self.workbook_values:
+            self.write_workbook()
+
+    def write_workbook(self):
+        """ Writes values filled since last write to chart's embedded workbook. """
+        values, self.workbook_values = self.workbook_values, []
+        externalData = self.xpath('//c:externalData', error=False)
+        if not externalData:
+            return
+        rels = self.package.parse(get_rels_name(self.xml_file)).getroot()
+        r = {r.get('Id'): r for r in rels}.get(externalData[0].get('{%s}id' % self.NS['r']))
+        if r is None or r.get('TargetMode') == 'External':
+            return
+
+        name = resolve_target(self.xml_file, r.get('Target'))
+        workbook = EmbeddedWorkbook(self.package.read(name))
+        for sheet, template_cells, filled_cells, sheet_values, numeric in values:
+            workbook.set_values(sheet, max(template_cells, filled_cells, key=len), sheet_values, numeric)
+            workbook.resize_tables(sheet, template_cells, filled_cells)
+        self.package.write(name, workbook.save())
+
     @property
     def x(self):
         return float(self.xpath('//c:x')[0].get('val'))
@@ -238,45 +1144,337 @@ class ChartFiller(XMLModifier):
             e.set('val', val)
 
 
+class EmbeddedWorkbook(object):
+    """
+    Xlsx package embedded into chart, values are written directly to sheets' xml.
+    """
+
+    NS = {
+        's': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+        'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    }
+    calc_chain_type = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/calcChain'
+    table_type = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/table'
+
+    def __init__(self, data):
+        """ Opens workbook.
+        :param data: xlsx bytes
+        """
+        self.package = Package.open(io.BytesIO(data))
+        self.workbook_name = next(
+            resolve_target('', r.get('Target')) for r in self.package.parse('_rels/.rels').getroot()
+            if r.get('Type').endswith('/officeDocument')
+        )
+        self.workbook_rels_name = get_rels_name(self.workbook_name)
+        targets = {
+            r.get('Id'): resolve_target(self.workbook_name, r.get('Target'))
+            for r in self.package.parse(self.workbook_rels_name).getroot()
+        }
+        self.sheet_names = {
+            e.get('name'): targets[e.get('{%s}id' % self.NS['r'])]
+            for e in self.package.parse(self.workbook_name).getroot().iter('{%s}sheet' % self.NS['s'])
+        }
+        self.sheets = {}
+        self.tables = {}
+        self.formulas_removed = False
+
+    def get_rows(self, sheet):
+        """ Returns sheet rows, sheet is parsed once.
+        :param sheet: sheet name
+        :return: (sheetData element, dictionary of rows by index) or None if there is no such sheet
+        """
+        if sheet not in self.sheets:
+            if sheet not in self.sheet_names:
+                return None
+            tree = self.package.parse(self.sheet_names[sheet])
+            sheetData = tree.getroot().find('{%s}sheetData' % self.NS['s'])
+            self.sheets[sheet] = tree, sheetData, {
+                int(row.get('r'))-1: row for row in sheetData.iterfind('{%s}row' % self.NS['s'])
+            }
+        tree, sheetData, rows = self.sheets[sheet]
+        return sheetData, rows
+
+    def set_values(self, sheet, cells, values, numeric=True):
+        """ Sets cell values, cell styles are kept.
+        :param sheet: sheet name
+        :param cells: cell indexes
+        :param values: cell values
+        :param numeric: whether to write values which look like numbers as numbers
+        """
+        sheet_rows = self.get_rows(sheet)
+        if sheet_rows is None:
+            return
+        sheetData, rows = sheet_rows
+        s = self.NS['s']
+
+        for (row_index, col_index), value in zip(cells, values):
+            row = rows.get(row_index)
+            if row is None:
+                row = rows[row_index] = etree.Element('{%s}row' % s, r=str(row_index+1))
+                following = [i for i in rows if i > row_index]
+                if following:
+                    rows[min(following)].addprevious(row)
+                else:
+                    sheetData.append(row)
+
+            name = xlrd.cellname(row_index, col_index)
+            cell = None
+            for e in row.iterfind('{%s}c' % s):
+                col = get_indices_from_name(e.get('r'))[1]
+                if col == col_index:
+                    cell = e
+                    break
+                if col > col_index:
+                    cell = etree.Element('{%s}c' % s, r=name)
+                    e.addprevious(cell)
+                    break
+            if cell is None:
+                cell = etree.SubElement(row, '{%s}c' % s, r=name)
+
+            f = cell.find('{%s}f' % s)
+            if f is not None:
+                self.formulas_removed = True
+                if f.get('t') == 'shared' and f.get('ref') is not None:
+                    # cells sharing formula of cleared master keep their values as constants
+                    for e in list(sheetData.iter('{%s}f' % s)):
+                        if e is not f and e.get('t') == 'shared' and e.get('si') == f.get('si'):
+                            remove(e)
+            for e in list(cell):
+                cell.remove(e)
+            cell.attrib.pop('t', None)
+            if value is None or value == '':
+                continue
+            is_number = numeric and not isinstance(value, bool)
+            if is_number:
+                try:
+                    float(value)
+                except (TypeError, ValueError):
+                    is_number = False
+            if is_number:
+                etree.SubElement(cell, '{%s}v' % s).text = '%s' % value
+            else:
+                cell.set('t', 'inlineStr')
+                etree.SubElement(etree.SubElement(cell, '{%s}is' % s), '{%s}t' % s).text = '%s' % value
+
+    def get_tables(self, sheet):
+        """ Returns tables of sheet, tables are parsed once.
+        :param sheet: sheet name
+        :return: list of (table part name, xml tree)
+        """
+        if sheet not in self.tables:
+            self.tables[sheet] = []
+            rels_name = get_rels_name(self.sheet_names[sheet])
+            if rels_name in self.package:
+                for r in self.package.parse(rels_name).getroot():
+                    if r.get('Type') == self.table_type and r.get('TargetMode') != 'External':
+                        name = resolve_target(self.sheet_names[sheet], r.get('Target'))
+                        self.tables[sheet].append((name, self.package.parse(name)))
+        return self.tables[sheet]
+
+    def resize_tables(self, sheet, cells, filled_cells):
+        """ Moves end of tables which ended with column range to the last filled cell.
+        :param sheet: sheet name
+        :param cells: cell indexes of template range
+        :param filled_cells: cell indexes of filled range
+        """
+        if sheet not in self.sheet_names or not filled_cells or cells[-1] == filled_cells[-1]:
+            return
+        if len({col for row, col in cells+filled_cells}) != 1:
+            return
+
+        s = self.NS['s']
+        row, col = cells[-1]
+        for name, tree in self.get_tables(sheet):
+            table = tree.getroot()
+            ref = table.get('ref')
+            (first_row, first_col), (last_row, last_col) = [get_indices_from_name(n) for n in ref.split(':')]
+            # tables with totals row would need the row to be moved together with its cells
+            if int(table.get('totalsRowCount', 0)) or last_row != row or not first_col <= col <= last_col:
+                continue
+            if cells[0][0] <= first_row:
+                continue
+            new_ref = '%s:%s' % (
+                xlrd.cellname(first_row, first_col),
+                xlrd.cellname(max(filled_cells[-1][0], first_row+1), last_col),
+            )
+            table.set('ref', new_ref)
+            autoFilter = table.find('{%s}autoFilter' % s)
+            if autoFilter is not None and autoFilter.get('ref') == ref:
+                autoFilter.set('ref', new_ref)
+            self.package.mark_dirty(name, tree)
+
+    def save(self):
+        """ Writes modified sheets to workbook.
+        :return: xlsx bytes
+        """
+        s = self.NS['s']
+        for sheet, (tree, sheetData, rows) in self.sheets.items():
+            indexes = [get_indices_from_name(c.get('r')) for c in sheetData.iter('{%s}c' % s)]
+            dimension = tree.getroot().find('{%s}dimension' % s)
+            if dimension is not None and indexes:
+                dimension.set('ref', '%s:%s' % (
+                    xlrd.cellname(min(i[0] for i in indexes), min(i[1] for i in indexes)),
+                    xlrd.cellname(max(i[0] for i in indexes), max(i[1] for i in indexes)),
+                ))
+            self.package.mark_dirty(self.sheet_names[sheet], tree)
+
+        if self.formulas_removed:
+            # calculation chain can't refer to cells which don't have formulas anymore
+            rels = self.package.parse(self.workbook_rels_name)
+            for r in list(rels.getroot()):
+                if r.get('Type') == self.calc_chain_type:
+                    remove(r)
+            self.package.serialize(self.workbook_rels_name, rels)
+            self.package.prune()
+
+        output = io.BytesIO()
+        self.package.save(output)
+        return output.getvalue()
+
+
 class PPTXGenerator(XMLModifier):
     """ Generates PPTX files from excel data and template """
 
+    TITLE_XPATH = '//p:spTree//*[*/p:cNvPr[@title=$title]]'
+
     template_shape_names = ()
     separate_charts = None
 
     slide_number = 1
     sheet_name = None
     separate_charts_dir = 'separate-charts'
-
-    def __init__(self, template, excel, dst='output.pptx', fill_empty=False, clean=False):
+    separate_charts_workers = 4
+    slide_relationship_types = (
+        'http://schemas.openxmlformats.org/officeDocument/2006/relationships/slideLayout',
+        'http://schemas.openxmlformats.org/officeDocument/2006/relationships/notesSlide',
+    )
+
+    def __init__(self, template, excel, dst='output.pptx', fill_empty=False, clean=False, separate_charts_dir=None,
+                 export_separate_charts=True, output_cache=None):
+        """ Generates presentation.
+        :param template: .pptx template
+        :param excel: excel file or already opened workbook
+        :param dst: file or file-like object where to save
+        :param separate_charts_dir: dir where to save separate charts, by default class's separate_charts_dir
+        :param export_separate_charts: whether to save separate charts
+        :param output_cache: OutputCache to take previously rendered files from, by default None
+        """
+        self.template = template
         self.fill_empty = fill_empty
         self.dst = dst
         self.clean = clean
-
-        workbook = xlrd.open_workbook(excel)
-        self.worksheet = None
-        if self.sheet_name:
+        self.export_separate_charts = export_separate_charts
+        if separate_charts_dir is not None:
+            self.separate_charts_dir = separate_charts_dir
+
+        workbook = excel if isinstance(excel, (xlrd.Book, XLSXBook)) else open_workbook(excel)
+        self.worksheet = self.get_worksheet(workbook)
+        self.sheet = SheetSnapshot(self.worksheet)
+        self.read_cells = set()
+
+        cache_key = None
+        if output_cache is not None and isinstance(dst, basestring):
+            cache_key = self.get_cache_key(template)
+            cells = output_cache.get(cache_key, self.get_outputs())
+            if cells is not None:
+                self.read_cells = {tuple(cell) for cell in cells}
+                return
+
+        self.package = template_cache.get(template)
+        self.relations = None
+        self.charts = {}
+        self.generate()
+
+        if cache_key is not None:
+            output_cache.put(cache_key, self.get_outputs(), sorted(self.read_cells))
+
+    @classmethod
+    def get_worksheet(cls, workbook):
+        """ Returns worksheet named sheet_name or the first one.
+        :param workbook: xlrd workbook or XLSXBook
+        :return: worksheet
+        """
+        if cls.sheet_name:
             try:
-                self.worksheet = workbook.sheet_by_name(self.sheet_name)
+                return workbook.sheet_by_name(cls.sheet_name)
             except xlrd.XLRDError:
                 pass
-        if not self.worksheet:
-            self.worksheet = workbook.sheet_by_index(0)
+        return workbook.sheet_by_index(0)
 
-        self.tmp_dir = unzip_pres(template)
+    @classmethod
+    def unload_worksheet(cls, workbook):
+        """ Frees worksheet returned by get_worksheet if workbook loads sheets on demand.
+        :param workbook: xlrd workbook or XLSXBook
+        """
+        if not getattr(workbook, 'on_demand', True):
+            return
+        if cls.sheet_name and cls.sheet_name in workbook.sheet_names():
+            workbook.unload_sheet(cls.sheet_name)
+        else:
+            workbook.unload_sheet(0)
 
-        try:
-            self.generate()
-        finally:
-            shutil.rmtree(self.tmp_dir)
+    @classmethod
+    def get_inputs_digest(cls, template, fill_empty=False, clean=False):
+        """ Returns hash of everything except excel values the render depends on.
+        :param template: .pptx template
+        :return: hex digest of template, generator classes' sources and options
+        """
+        digest = hashlib.sha1()
+        with open(template, 'rb') as f:
+            digest.update(f.read())
+        for klass in cls.__mro__:
+            if klass is not object:
+                with open(inspect.getsourcefile(klass), 'rb') as f:
+                    digest.update(f.read())
+        digest.update(repr((fill_empty, clean)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get_cache_key(self, template):
+        """ Returns output cache key of render.
+        :param template: .pptx template
+        :return: hex digest of inputs and sheet values
+        """
+        return hashlib.sha1(repr((
+            self.get_inputs_digest(template, self.fill_empty, self.clean),
+            self.sheet.get_digest(),
+            self.export_separate_charts,
+        )).encode('utf-8')).hexdigest()
+
+    def get_outputs(self):
+        """ Returns files produced by render.
+        :return: list of (output name, path)
+        """
+        outputs = [('output.pptx', self.dst)]
+        if self.export_separate_charts:
+            outputs.extend(
+                (posixpath.join('separate-charts', path_name), os.path.join(self.separate_charts_dir, path_name))
+                for path_name in (self.separate_charts or {}).values()
+            )
+        return outputs
+
+    def get_dependencies(self, template):
+        """ Returns cells read during render with hash of their values and produced files.
+        :param template: .pptx template
+        :return: dictionary of dependencies
+        """
+        cells = [xlrd.cellname(row, col) for row, col in sorted(self.read_cells)]
+        return {
+            'inputs': self.get_inputs_digest(template, self.fill_empty, self.clean),
+            'cells': cells,
+            'values': get_cells_digest(self.sheet, cells),
+            'outputs': [path for name, path in self.get_outputs()],
+        }
 
     def generate(self):
         """ Generates presentation from template and excel values. """
-        super(PPTXGenerator, self).__init__(self.get_slide_path())
+        super(PPTXGenerator, self).__init__(self.get_slide_path(), self.package)
 
-        self.tree = etree.parse(self.get_slide_path())
         self.last_id = max(int(e.get('id')) for e in self.xpath('//*[@id]'))
-        self.shapes = self.xpath('//p:spTree')[0]
+        self.shapes = self.spTree = self.xpath('//p:spTree')[0]
+        self.titles = {}
+        self.index_titles(self.spTree)
+        self.indexed_shapes = len(self.spTree)
+        self.handed_out = {}
         if self.clean:
             for x in ['p:sp', 'p:pic', 'p:cxnSp']:
                 for e in self.xpath('//p:spTree/%s[not(*//p:cNvPr[@title])]' % x, error=False):
@@ -285,7 +1483,7 @@ class PPTXGenerator(XMLModifier):
         self.template_shapes = {}
         not_found = []
         for name in self.template_shape_names:
-            elements = self.xpath('//p:spTree//*[*/p:cNvPr[@title="%s"]]' % name, error=False)
+            elements = self.get_elements_by_title(name, error=False)
             if len(elements) == 0:
                 not_found.append(name)
                 continue
@@ -310,35 +1508,31 @@ class PPTXGenerator(XMLModifier):
 
         self.write()
 
-        zip_pres_dir(self.tmp_dir, self.dst)
+        self.package.save(self.dst)
 
-        def get_sldSz(root_dir):
-            """ Returns slide size.
-            :param path: template path
-            :return: slide size
-            """
-             return etree.parse(
-                os.path.join(root_dir, 'ppt', 'presentation.xml')
-            ).xpath('//p:sldSz', namespaces=self.NS)[0]
-
-        def get_proportions(sldSz):
-            """ Returns slide proportions.
-            :param sldSz: slide size
-            :return: slide proportions
-            """
-            return int(sldSz.get('cx'))/int(sldSz.get('cy'))
+        if self.export_separate_charts:
+            self.save_separate_charts()
+
+    def save_separate_charts(self):
+        """ Saves elements from separate_charts to their own presentations.
 
-        def set_slide_sizes(root_dir, e_w, e_h):
+        Each presentation is derived from filled package, parts which aren't
+        reachable from the single-element slide are left out. Presentations
+        are compressed and written by separate_charts_workers threads.
+        """
+        if not self.separate_charts:
+            return
+
+        pres_tree = self.package.parse('ppt/presentation.xml')
+        sldSz = pres_tree.xpath('//p:sldSz', namespaces=self.NS)[0]
+        main_proportions = int(sldSz.get('cx'))/int(sldSz.get('cy'))
+
+        def set_slide_sizes(e_w, e_h):
             """ Returns slide sizes.
-            :param root_dir: template path
             :param e_w: slide width
             :param e_h: slide height
             :return: slide width and height
             """
-            path = os.path.join(root_dir, 'ppt', 'presentation.xml')
-            pres_tree = etree.parse(path)
-            sldSz = pres_tree.xpath('//p:sldSz', namespaces=self.NS)[0]
-
             proportions = e_w/e_h
             if proportions < main_proportions:
                 e_w = int(round(e_h*main_proportions, 0))
@@ -347,82 +1541,158 @@ class PPTXGenerator(XMLModifier):
 
             sldSz.set('cx', str(e_w))
             sldSz.set('cy', str(e_h))
-            pres_tree.write(path)
 
             return e_w, e_h
 
-        sldSz = get_sldSz(self.tmp_dir)
-        main_proportions = get_proportions(sldSz)
+        slide_tree = copy.deepcopy(self.tree)
+        spTree = slide_tree.xpath('//p:spTree', namespaces=self.NS)[0]
+        spTree.clear()
+        spTree.append(copy.deepcopy(self.xpath('//p:spTree/p:nvGrpSpPr')[0]))
+        spTree.append(copy.deepcopy(self.xpath('//p:spTree/p:grpSpPr')[0]))
 
-        for element_name, path_name in (self.separate_charts or {}).items():
-            e = copy.deepcopy(self.E(element_name))
-            e_w, e_h = self.get_element_sizes(e)
-            nvGrpSpPr = copy.deepcopy(self.xpath('//p:spTree/p:nvGrpSpPr')[0])
-            grpSpPr = copy.deepcopy(self.xpath('//p:spTree/p:grpSpPr')[0])
-            separate_tmp_dir = tempfile.mkdtemp()
-            try:
-                distutils.dir_util.copy_tree(self.tmp_dir, separate_tmp_dir)
-                slide_w, slide_h = set_slide_sizes(separate_tmp_dir, e_w, e_h)
+        try:
+            os.mkdir(self.separate_charts_dir)
+        except OSError:
+            pass
+
+        pool = ThreadPool(self.separate_charts_workers) if self.separate_charts_workers > 1 else None
+        try:
+            results = []
+            for element_name, path_name in self.separate_charts.items():
+                e = copy.deepcopy(self.E(element_name))
+                e_w, e_h = self.get_element_sizes(e)
+                slide_w, slide_h = set_slide_sizes(e_w, e_h)
                 self.set_element_pos(e, (slide_w-e_w)/2, (slide_h-e_h)/2)
-                tree = etree.parse(self.get_slide_path(path=separate_tmp_dir))
-                spTree = tree.xpath('//p:spTree', namespaces=self.NS)[0]
-                spTree.clear()
-                spTree.append(nvGrpSpPr)
-                spTree.append(grpSpPr)
-                spTree.append(e)
-                tree.write(self.get_slide_path(path=separate_tmp_dir))
+                tree = copy.deepcopy(slide_tree)
+                tree.xpath('//p:spTree', namespaces=self.NS)[0].append(e)
+
+                separate_package = self.get_separate_package(tree)
+                separate_package.serialize('ppt/presentation.xml', pres_tree)
+                dst = os.path.join(self.separate_charts_dir, path_name)
+                if pool is None:
+                    separate_package.save(dst)
+                else:
+                    results.append(pool.apply_async(separate_package.save, (dst,)))
+
+            for result in results:
+                result.get()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def get_separate_package(self, tree):
+        """ Returns package copy with given slide, unused slide relations and parts are removed.
+        :param tree: slide xml tree
+        :return: package
+        """
+        package = self.package.copy()
+        slide_path = self.get_slide_path()
+        package.serialize(slide_path, tree)
+
+        rels_name = get_rels_name(slide_path)
+        rels = package.parse(rels_name)
+        r_prefix = '{%s}' % self.NS['r']
+        used_ids = {
+            value for e in tree.iter() for key, value in e.attrib.items() if key.startswith(r_prefix)
+        }
+        for r in list(rels.getroot()):
+            if r.get('Id') not in used_ids and r.get('Type') not in self.slide_relationship_types:
+                remove(r)
+        package.serialize(rels_name, rels)
 
-                try:
-                    os.mkdir(self.separate_charts_dir)
-                except OSError:
-                    pass
-                zf = zipfile.ZipFile(os.path.join(self.separate_charts_dir, path_name), "w", zipfile.ZIP_DEFLATED)
-                for root, dirs, files in os.walk(separate_tmp_dir):
-                    for filename in files:
-                        full_path = os.path.join(root, filename)
-                        zf.write(full_path, os.path.relpath(full_path, separate_tmp_dir))
-                zf.close()
-            finally:
-                shutil.rmtree(separate_tmp_dir)
+        package.prune()
+        return package
 
     def get_relations(self):
-        """ Returns slide relations.
+        """ Returns slide relations, they are read once per render.
         :return: dictionary of relations
         """
-        path = os.path.join(self.tmp_dir, 'ppt', 'slides', '_rels', 'slide%s.xml.rels' % self.slide_number)
-        rels = etree.parse(path).getroot()
-        return {
-            r.get('Id'): os.path.abspath(os.path.join(self.get_slide_path(), '..', r.get('Target'))) for r in rels
-        }
+        if self.relations is None:
+            slide_path = self.get_slide_path()
+            rels = self.package.parse(get_rels_name(slide_path)).getroot()
+            self.relations = {
+                r.get('Id'): resolve_target(slide_path, r.get('Target')) for r in rels
+            }
+        return self.relations
+
+    def index_titles(self, e):
+        """ Adds element and its descendants with titles to title index.
+        :param e: ooxml element
+        """
+        for cNvPr in e.iter('{%s}cNvPr' % self.NS['p']):
+            title = cNvPr.get('title')
+            shape = cNvPr.getparent().getparent()
+            if title is None or shape is None:
+                continue
+            elements = self.titles.setdefault(title, [])
+            if shape not in elements:
+                elements.append(shape)
+
+    def refresh_titles(self):
+        """ Indexes elements which dashboard code inserted into tree directly.
+
+        Such elements are appended to elements returned by title lookups or
+        to shape tree, so these are indexed again once their number of
+        children changed. Shape tree isn't indexed again after add_shape.
+        """
+        if len(self.spTree) != self.indexed_shapes:
+            self.index_titles(self.spTree)
+            self.indexed_shapes = len(self.spTree)
+        for e, size in self.handed_out.items():
+            if len(e) != size:
+                self.index_titles(e)
+                self.handed_out[e] = len(e)
+
+    def is_in_slide(self, e):
+        """ Checks whether element is still attached to slide's shape tree.
+        :param e: ooxml element
+        :return: True or False
+        """
+        return next(e.iterancestors('{%s}spTree' % self.NS['p']), None) is self.spTree
 
     def get_elements_by_title(self, title, error=True):
         """ Returns list of elements choosed by title.
+
+        Elements are looked up in title index, removed ones are skipped. XPath
+        is used when index doesn't give exactly one element, so several found
+        elements are always in document order. Returned elements may get new
+        children, so they are indexed again before following lookups.
         :param title: ooxml element's title
         :param error: errors, True by default
         :return: list of elements
         """
-        return self.xpath('//p:spTree//*[*/p:cNvPr[@title="%s"]]' % title, error=error)
+        self.refresh_titles()
+        elements = [e for e in self.titles.get(title, ()) if self.is_in_slide(e)]
+        if len(elements) != 1:
+            elements = self.xpath(self.TITLE_XPATH, error=error, title=title)
+        self.titles[title] = list(elements)
+        for e in elements:
+            self.handed_out.setdefault(e, len(e))
+        return elements
 
     def get_element_by_title(self, title):
         """ Returns first element choosed by title.
         :param title: ooxml element title
         :return: first ooxml element
         """
-        xpath = '//p:spTree//*[*/p:cNvPr[@title="%s"]]' % title
-        elements = self.xpath(xpath)
+        elements = self.get_elements_by_title(title)
         if len(elements) > 1:
-            warnings.warn('The only element is expected at XPath `%s`, %s found.' % (xpath, len(elements)))
+            warnings.warn('The only element is expected at XPath `%s` with title `%s`, %s found.' % (
+                self.TITLE_XPATH,
+                title,
+                len(elements),
+            ))
             for e in elements:
                 print etree.tostring(e)
         return elements[0]
     E = get_element_by_title
 
-    def get_slide_path(self, path=None):
-        """ Returns slide path.
-        :param path: slide path, by default None
-        :return: slide path
+    def get_slide_path(self):
+        """ Returns slide part name.
+        :return: slide part name
         """
-        return os.path.join(path or self.tmp_dir, 'ppt', 'slides', 'slide%s.xml' % self.slide_number)
+        return 'ppt/slides/slide%s.xml' % self.slide_number
 
     def with_comma(self, v):
         """ Adds comma if value is 4 digits or more.
@@ -487,10 +1757,18 @@ class PPTXGenerator(XMLModifier):
         filled_cells = set()
         duplicated = set()
 
+        plan = self.get_fill_plan()
+        root = self.tree.getroot()
         for conv, cells in self.get_simple_fillers().iteritems():
             for cell in itertools.chain.from_iterable(cells):
-                (duplicated if cell in filled_cells else filled_cells).add(cell)
-                val = self.get_cell(cell)
+                is_duplicated = cell in filled_cells
+                (duplicated if is_duplicated else filled_cells).add(cell)
+                target = plan.get(cell)
+                if target is None:
+                    target = plan[cell] = self.compile_fill_target(cell)
+                row, col, text_path, removed_paths = target
+                self.read_cells.add((row, col))
+                val = self.sheet.get(row, col)
                 try:
                     val = conv(val)
                 except Exception as e:
@@ -503,7 +1781,13 @@ class PPTXGenerator(XMLModifier):
                     )
                     val = 'INVALID VALUE'
                 try:
-                    self.set_text(cell, val)
+                    if text_path is None:
+                        self.set_text(cell, val)
+                    else:
+                        get_element_by_path(root, text_path).text = '' if self.fill_empty else val
+                        if not is_duplicated:
+                            for e in [get_element_by_path(root, path) for path in removed_paths]:
+                                remove(e)
                 except Exception as e:
                     warnings.warn(
                         'Could not set text for element %s.\nError was: %s' % (
@@ -522,12 +1806,46 @@ class PPTXGenerator(XMLModifier):
         if duplicated:
             warnings.warn('These cell were filled several times:\n%s' % duplicated)
 
+    def get_fill_plan(self):
+        """ Returns targets of simple fillers compiled for the class and template.
+
+        Simple fillers run first in fill_values, so slide is in the same state
+        on every render and targets are addressed by element paths. Plan is
+        cached together with the template.
+        :return: dictionary of cell name -> (row, col, text path, paths of removed runs)
+        """
+        plans = template_cache.get_plans(self.template)
+        key = (self.__class__, self.clean)
+        if key not in plans:
+            plans[key] = {}
+        return plans[key]
+
+    def compile_fill_target(self, cell):
+        """ Resolves cell's text element.
+        :param cell: excel cell name (A1, B4 etc)
+        :return: (row, col, text path, paths of removed runs), text path is None if there is no text element
+        """
+        row, col = get_indices_from_name(cell)
+        shape = self.shapes.get(cell)
+        elements = self.xpath('.//a:t', shape) if shape is not None else []
+        if not elements:
+            return row, col, None, ()
+        return (
+            row,
+            col,
+            get_element_path(elements[0]),
+            tuple(get_element_path(e.getparent()) for e in elements[1:]),
+        )
+
     def get_chart(self, path):
-        """ Returns chart by path.
+        """ Returns chart by path, each chart is parsed once per render.
         :param path: chart path
         :return: Chart Filler
         """
-        return ChartFiller(self, path)
+        chart = self.charts.get(path)
+        if chart is None:
+            chart = self.charts[path] = ChartFiller(self, path)
+        return chart
 
     def get_chart_by_title(self, title):
         """ Returns chart by title.
@@ -540,11 +1858,11 @@ class PPTXGenerator(XMLModifier):
         return self.get_chart(self.get_relations()[id])
 
     def get_chart_path(self, chart):
-        """ Returns chart path.
+        """ Returns chart part name.
         :param chart: chart name
-        :return: chart path
+        :return: chart part name
         """
-        return os.path.join(self.tmp_dir, 'ppt', 'charts', 'chart%s.xml' % chart)
+        return 'ppt/charts/chart%s.xml' % chart
 
     def fill_chart(self, chart, data, conv=None):
         """ Fills chart with data.
@@ -569,7 +1887,24 @@ class PPTXGenerator(XMLModifier):
         :return: cell
         """
         row, col = get_indices_from_name(name)
-        return self.worksheet.row_values(row)[col]
+        self.read_cells.add((row, col))
+        return self.sheet.get(row, col)
+
+    def get_range(self, cells):
+        """ Returns values of cells grouped by rows.
+        :param cells: excel cell names (C('B19', 'Z22'))
+        :return: list of rows with cell values
+        """
+        rows = []
+        last_row = None
+        for name in cells:
+            row, col = get_indices_from_name(name)
+            if row != last_row:
+                rows.append([])
+                last_row = row
+            self.read_cells.add((row, col))
+            rows[-1].append(self.sheet.get(row, col))
+        return rows
 
     def set_text(self, name, text):
         """ Set text on shape.
@@ -673,7 +2008,9 @@ class PPTXGenerator(XMLModifier):
         i = self.get_id()
         cNvPr.set('id', str(i))
         cNvPr.set('name', '%s %s' % (cNvPr.get('name'), i))
-        self.xpath('//p:spTree')[0].append(e)
+        self.spTree.append(e)
+        self.indexed_shapes += 1
+        self.index_titles(e)
 
     def set_element_pos(self, e, x, y):
         """ Function sets element (x,y) position.
@@ -719,7 +2056,9 @@ class PPTXGenerator(XMLModifier):
         :param name: template name
         :return: template copy
         """
-        return copy.deepcopy(self.template_shapes[name])
+        e = copy.deepcopy(self.template_shapes[name])
+        self.index_titles(e)
+        return e
 
     def add_line(self, x0, y0, x1, y1, template_name, shapes=None):
         """ Function creates line.
@@ -879,19 +2218,165 @@ class PPTXGenerator(XMLModifier):
             del xfrm.attrib['flipH']
 
 
+def render_batch_file(args):
+    """ Renders batch file in pool worker.
+    :param args: (batch renderer, excel file)
+    :return: render result
+    """
+    renderer, excel = args
+    return renderer.render(excel)
+
+
+class BatchRenderer(object):
+    """
+    Renders one dashboard template against many excel files.
+
+    Template is loaded to template cache before workers are forked, so every
+    worker reuses parsed template. Failed files are reported and skipped.
+    """
+
+    def __init__(self, dashboard_class, template, output_dir='.', jobs=1, fill_empty=False, clean=False):
+        """ Initialize batch.
+        :param dashboard_class: PPTXGenerator subclass
+        :param template: .pptx template
+        :param output_dir: dir where to save presentations
+        :param jobs: number of worker processes
+        """
+        self.dashboard_class = dashboard_class
+        self.template = template
+        self.output_dir = output_dir
+        self.jobs = jobs
+        self.fill_empty = fill_empty
+        self.clean = clean
+
+    @staticmethod
+    def get_excel_files(src):
+        """ Returns excel files from directory or manifest file with one path per line.
+        :param src: directory or manifest file
+        :return: list of excel files
+        """
+        if os.path.isdir(src):
+            return sorted(
+                os.path.join(src, name) for name in os.listdir(src)
+                if name.lower().endswith('.xlsx') and not name.startswith('~$')
+            )
+
+        with open(src) as f:
+            lines = [line.strip() for line in f]
+        return [
+            os.path.join(os.path.dirname(src), line) for line in lines if line and not line.startswith('#')
+        ]
+
+    def get_dst(self, excel):
+        """ Returns presentation path for excel file.
+        :param excel: excel file
+        :return: .pptx path
+        """
+        return os.path.join(self.output_dir, '%s.pptx' % os.path.splitext(os.path.basename(excel))[0])
+
+    def render(self, excel):
+        """ Renders presentation for excel file.
+        :param excel: excel file
+        :return: (excel file, .pptx path or None if failed, seconds, traceback or None)
+        """
+        dst = self.get_dst(excel)
+        start = time.time()
+        try:
+            self.dashboard_class(
+                self.template,
+                excel,
+                dst=dst,
+                fill_empty=self.fill_empty,
+                clean=self.clean,
+                separate_charts_dir='%s-separate-charts' % os.path.splitext(dst)[0],
+            )
+        except (Exception, SystemExit):
+            return excel, None, time.time()-start, traceback.format_exc()
+        return excel, dst, time.time()-start, None
+
+    def run(self, excel_files):
+        """ Renders presentations for all excel files and reports results.
+        :param excel_files: list of excel files
+        :return: list of render results
+        """
+        try:
+            os.makedirs(self.output_dir)
+        except OSError:
+            pass
+        template_cache.get(self.template)
+
+        start = time.time()
+        results = []
+        pool = multiprocessing.Pool(self.jobs) if self.jobs > 1 else None
+        try:
+            if pool is None:
+                rendered = (self.render(excel) for excel in excel_files)
+            else:
+                rendered = pool.imap_unordered(render_batch_file, [(self, excel) for excel in excel_files])
+            for excel, dst, seconds, error in rendered:
+                if error is None:
+                    print '%s -> %s (%.2fs)' % (excel, dst, seconds)
+                else:
+                    print '%s FAILED (%.2fs)\n%s' % (excel, seconds, error)
+                results.append((excel, dst, seconds, error))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        failed = sum(1 for result in results if result[3] is not None)
+        print 'Rendered %s of %s files in %.2fs, %s failed.' % (
+            len(results)-failed, len(results), time.time()-start, failed)
+        return results
+
+
 class CMDHandler(object):
     """
     Class that handles command line options and starts template generation.
+
+    With --batch the data file is a directory or a manifest of excel files,
+    outputs are saved to --output-dir (batch-output by default) using
+    --jobs worker processes. With --cache-dir previously rendered outputs
+    are reused.
     """
     def __init__(self, dashboard_class, template_path=None, dst=None):
         if len(sys.argv) <= 1:
             print "Data file is not specified!"
             sys.exit(1)
 
+        template_path = template_path or os.path.join(os.path.dirname(sys.argv[0]), 'template.pptx')
+
+        if '--batch' in sys.argv:
+            results = BatchRenderer(
+                dashboard_class,
+                template_path,
+                output_dir=self.get_option('output-dir', 'batch-output'),
+                jobs=int(self.get_option('jobs', 1)),
+                fill_empty='--fill-empty' in sys.argv,
+                clean='--clean' in sys.argv,
+            ).run(BatchRenderer.get_excel_files(sys.argv[-1]))
+            if any(result[3] is not None for result in results):
+                sys.exit(1)
+            return
+
+        cache_dir = self.get_option('cache-dir')
         dashboard_class(
-            template_path or os.path.join(os.path.dirname(sys.argv[0]), 'template.pptx'),
+            template_path,
             sys.argv[-1],
             fill_empty='--fill-empty' in sys.argv,
             clean='--clean' in sys.argv,
             dst=dst or 'output.pptx',
+            output_cache=OutputCache(cache_dir) if cache_dir else None,
         )
+
+    def get_option(self, name, default=None):
+        """ Returns value of --name=value command line option.
+        :param name: option name
+        :param default: value if option isn't specified
+        :return: option value
+        """
+        prefix = '--%s=' % name
+        for arg in sys.argv[1:]:
+            if arg.startswith(prefix):
+                return arg[len(prefix):]
+        return default
@@ -3,8 +3,14 @@
 from __future__ import unicode_literals
 
 import argparse
+import imp
+import json
+import multiprocessing
 import os
-import subprocess
+import traceback
+
+from data2ppt import OutputCache, SheetSnapshot, get_cells_digest, open_workbook, template_cache
+from merge import PresentationMerger
 
 OUTFILE = 'output.pptx'
 DASHBOARD_SEQUENCE = [
@@ -22,18 +28,187 @@ DASHBOARD_SEQUENCE = [
     12,
 ]
 
+dashboard_classes = {}
+pool_workbook = None
+
+
+def get_dashboard_dir(n):
+    """ Returns dashboard directory.
+    :param n: dashboard number
+    :return: dashboard directory
+    """
+    return 'dashboard-%s' % n
+
+
+def load_dashboard_class(n):
+    """ Imports dashboard's main.py and returns its generator class.
+    :param n: dashboard number
+    :return: dashboard class
+    """
+    if n not in dashboard_classes:
+        module = imp.load_source('dashboard%s' % n, os.path.join(get_dashboard_dir(n), 'main.py'))
+        dashboard_classes[n] = getattr(module, 'Dashboard%s' % n)
+    return dashboard_classes[n]
+
+
+def get_template_path(n):
+    """ Returns dashboard template path.
+    :param n: dashboard number
+    :return: template path
+    """
+    return os.path.join(get_dashboard_dir(n), 'template.pptx')
+
+
+def get_dependencies_path(n):
+    """ Returns path of file with cells dashboard depends on.
+    :param n: dashboard number
+    :return: dependencies file path
+    """
+    return os.path.join(get_dashboard_dir(n), 'output.deps.json')
+
+
+def is_up_to_date(n, workbook):
+    """ Checks whether dashboard's previous outputs were rendered from the same inputs.
+    :param n: dashboard number
+    :param workbook: opened workbook
+    :return: True or False
+    """
+    try:
+        with open(get_dependencies_path(n)) as f:
+            dependencies = json.load(f)
+    except (IOError, ValueError):
+        return False
+
+    dashboard_class = load_dashboard_class(n)
+    return (
+        dependencies['inputs'] == dashboard_class.get_inputs_digest(get_template_path(n)) and
+        all(os.path.exists(output) for output in dependencies['outputs']) and
+        dependencies['values'] == get_cells_digest(
+            SheetSnapshot(dashboard_class.get_worksheet(workbook)),
+            dependencies['cells'],
+        )
+    )
+
+
+def render_dashboard(n, workbook, incremental=False, output_cache=None):
+    """ Renders dashboard to output.pptx in its directory.
+
+    In incremental mode rendering is skipped if none of the cells dashboard
+    read last time has changed, cells read are saved to output.deps.json.
+    Other renders remove output.deps.json so it never describes newer outputs.
+    Dashboard's sheet is unloaded from the shared workbook afterwards.
+    :param n: dashboard number
+    :param workbook: opened workbook
+    :param incremental: whether to skip up to date dashboards
+    :param output_cache: OutputCache to reuse previously rendered outputs from
+    :return: path to rendered presentation
+    """
+    dst = os.path.join(get_dashboard_dir(n), OUTFILE)
+    dashboard_class = load_dashboard_class(n)
+    try:
+        if incremental and is_up_to_date(n, workbook):
+            print 'Dashboard %s is up to date.' % n
+            return dst
+
+        # outputs are about to change, a stale dependencies file must not outlive them
+        dependencies_path = get_dependencies_path(n)
+        if os.path.exists(dependencies_path):
+            os.remove(dependencies_path)
+        if not incremental:
+            dashboard_class(get_template_path(n), workbook, dst=dst, output_cache=output_cache)
+            return dst
+
+        generator = dashboard_class(get_template_path(n), workbook, dst=dst, output_cache=output_cache)
+        with open(dependencies_path, 'w') as f:
+            json.dump(generator.get_dependencies(get_template_path(n)), f)
+        return dst
+    finally:
+        dashboard_class.unload_worksheet(workbook)
+
+
+def try_render_dashboard(n, workbook, incremental=False, output_cache=None):
+    """ Renders dashboard, reports failure instead of raising it.
+    :param n: dashboard number
+    :param workbook: opened workbook
+    :param incremental: whether to skip up to date dashboards
+    :param output_cache: OutputCache to reuse previously rendered outputs from
+    :return: path to rendered presentation or None if dashboard failed
+    """
+    try:
+        return render_dashboard(n, workbook, incremental, output_cache)
+    except (Exception, SystemExit):
+        print 'Dashboard %s failed:' % n
+        traceback.print_exc()
+
+
+def render_pool_dashboard(args):
+    """ Renders dashboard in pool worker using workbook inherited from parent process.
+    :param args: (dashboard number, incremental, output cache)
+    :return: path to rendered presentation or None if dashboard failed
+    """
+    n, incremental, output_cache = args
+    return try_render_dashboard(n, pool_workbook, incremental, output_cache)
+
+
+def warm_up(sequence):
+    """ Imports dashboard classes and loads their templates to template cache.
+    :param sequence: dashboard numbers
+    """
+    for n in sequence:
+        try:
+            load_dashboard_class(n)
+            template_cache.get(get_template_path(n))
+        except Exception:
+            pass
+
+
+def render_dashboards(excel, sequence=DASHBOARD_SEQUENCE, jobs=1, incremental=False, output_cache=None):
+    """ Renders dashboards sharing the same workbook.
+
+    With several jobs dashboards are rendered on a process pool. Workbook,
+    dashboard classes and templates are loaded before workers are forked,
+    every sheet is parsed by the worker rendering its dashboard.
+    :param excel: excel file
+    :param sequence: dashboard numbers
+    :param jobs: number of worker processes
+    :param incremental: whether to skip up to date dashboards
+    :param output_cache: OutputCache to reuse previously rendered outputs from
+    :return: paths to rendered presentations in sequence order, failed dashboards are skipped
+    """
+    global pool_workbook
+
+    workbook = open_workbook(excel)
+    if jobs > 1:
+        pool_workbook = workbook
+        warm_up(sequence)
+        pool = multiprocessing.Pool(min(jobs, len(sequence)))
+        try:
+            outputs = pool.map(render_pool_dashboard, [(n, incremental, output_cache) for n in sequence], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        outputs = [try_render_dashboard(n, workbook, incremental, output_cache) for n in sequence]
+    return [dst for dst in outputs if dst]
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('xslx-file')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='number of dashboards rendered concurrently')
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='skip dashboards whose cells did not change since previous run',
+    )
+    parser.add_argument('--cache-dir', help='directory of cache of rendered dashboards keyed by their inputs')
     args = parser.parse_args()
 
-    dashboard_dirs = ['dashboard-%s' % n for n in DASHBOARD_SEQUENCE]
-    for dashboard_dir in dashboard_dirs:
-        subprocess.call([
-            os.path.join(dashboard_dir, 'main.py'),
-            '--output=%s' % os.path.join(dashboard_dir, OUTFILE),
-            os.path.abspath(vars(args)['xslx-file']),
-        ])
-    subprocess.call(
-        [os.path.join('.', 'merge.py')]+[os.path.join(dashboard_dir, OUTFILE) for dashboard_dir in dashboard_dirs],
-    )
+    PresentationMerger(
+        render_dashboards(
+            vars(args)['xslx-file'],
+            jobs=args.jobs,
+            incremental=args.incremental,
+            output_cache=OutputCache(args.cache_dir) if args.cache_dir else None,
+        ),
+    ).merge()
@@ -4,50 +4,126 @@ from __future__ import unicode_literals
 
 import argparse
 import copy
-import shutil
-import os
+import hashlib
 from os import path
+import zipfile
 
 from lxml import etree
 
 
-from data2ppt import XMLModifier, zip_pres_dir, unzip_pres
+from data2ppt import Package, XMLModifier, get_member_order, get_rels_name, resolve_target
 
 OUTFILE = 'output.pptx'
 
 
 class PresentationMerger(object):
 
+    non_follow_types = [
+        'http://schemas.openxmlformats.org/officeDocument/2006/relationships/slideMaster',
+        'http://schemas.openxmlformats.org/officeDocument/2006/relationships/notesMaster',
+        'http://schemas.openxmlformats.org/officeDocument/2006/relationships/slideLayout',
+        'http://schemas.openxmlformats.org/officeDocument/2006/relationships/oleObject',
+    ]
+    # parts of these types without own relationships are stored once if their content is identical,
+    # embedded packages aren't shared because Edit Data writes back to them
+    shared_types = [
+        'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image',
+        'http://schemas.microsoft.com/office/2011/relationships/chartStyle',
+        'http://schemas.microsoft.com/office/2011/relationships/chartColorStyle',
+    ]
+
     def __init__(self, presentations):
         self.presentations = presentations
 
     def merge(self):
-        self.dirs = [unzip_pres(pres) for pres in self.presentations]
+        """ Streams parts of all presentations into output archive.
+
+        Parts are copied without recompression, only relationships, content
+        types and presentation.xml of the first presentation are rewritten.
+        Members are written in the same canonical order as Package.save uses.
+        """
+        main_package = Package.open(self.presentations[0])
+
+        self.content_types = XMLModifier('[Content_Types].xml', main_package)
+        self.default_content_types = {
+            e.get('Extension'): e for e in self.content_types.tree.getroot().iter(tag='{*}Default')
+        }
+        self.override_content_types = {
+            e.get('PartName'): e for e in self.content_types.tree.getroot().iter(tag='{*}Override')
+        }
+        self.pres_rels = XMLModifier('ppt/_rels/presentation.xml.rels', main_package)
+        self.pres = XMLModifier('ppt/presentation.xml', main_package)
+        self.last_slide_id = int(self.pres.xpath('//p:sldId')[0].get('id'))
+        rewritten = [self.content_types, self.pres_rels, self.pres]
+
+        self.shared_parts = {}
+        for e in self.pres_rels.tree.getroot():
+            if e.get('Type') == 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/slide':
+                self.index_shared_parts(main_package, resolve_target('ppt/presentation.xml', e.get('Target')), set())
+
+        # output member name -> (package, part name), written once all names are known
+        self.members = {}
+        self.rels = Package()
+        for name in main_package:
+            if all(name != modifier.xml_file for modifier in rewritten):
+                self.members[name] = (main_package, name)
+
+        for i, presentation in enumerate(self.presentations[1:], 2):
+            self.merge_presentation_package(Package.open(presentation), i)
+
+        for modifier in rewritten:
+            modifier.write()
+            self.members[modifier.xml_file] = (main_package, modifier.xml_file)
+
+        output = zipfile.ZipFile(OUTFILE, 'w', zipfile.ZIP_DEFLATED)
         try:
-            self.main_dir = self.dirs[0]
-
-            self.content_types = XMLModifier(path.join(self.main_dir, '[Content_Types].xml'))
-            self.default_content_types = {
-                e.get('Extension') for e in self.content_types.tree.getroot().iter(tag='{*}Default')
-            }
-            self.pres_rels = XMLModifier(path.join(self.main_dir, 'ppt', '_rels', 'presentation.xml.rels'))
-            self.pres = XMLModifier(path.join(self.main_dir, 'ppt', 'presentation.xml'))
-            self.last_slide_id = int(self.pres.xpath('//p:sldId')[0].get('id'))
-
-            for i, d in enumerate(self.dirs[1:], 2):
-                self.merge_presentation_dir(d, i)
-
-            self.content_types.write()
-            self.pres_rels.write()
-            self.pres.write()
-
-            zip_pres_dir(self.main_dir, OUTFILE)
+            for arcname in get_member_order(self.members):
+                package, name = self.members[arcname]
+                package.write_to(output, name, arcname)
         finally:
-            for d in self.dirs:
-                shutil.rmtree(d)
+            output.close()
+
+    def is_shared(self, package, name, rel_type):
+        """ Checks whether part may be shared with identical parts of other presentations.
+        :param package: presentation package
+        :param name: part name
+        :param rel_type: type of relationship pointing to part
+        :return: True or False
+        """
+        return rel_type in self.shared_types and get_rels_name(name) not in package
+
+    def get_digest(self, package, name):
+        """ Returns hash of part content.
+        :param package: presentation package
+        :param name: part name
+        :return: hex digest
+        """
+        return hashlib.sha1(package.read(name)).hexdigest()
+
+    def index_shared_parts(self, package, name, seen):
+        """ Registers sharable parts related to first presentation's part.
+        :param package: first presentation package
+        :param name: part name
+        :param seen: already visited part names
+        """
+        rels_name = get_rels_name(name)
+        if name in seen or rels_name not in package:
+            return
+        seen.add(name)
+
+        for e in package.parse(rels_name).getroot():
+            if e.get('Type') in self.non_follow_types or e.get('TargetMode') == 'External':
+                continue
+            target = resolve_target(name, e.get('Target'))
+            if target not in package:
+                continue
+            if self.is_shared(package, target, e.get('Type')):
+                self.shared_parts.setdefault(self.get_digest(package, target), path.join('/', target))
+            else:
+                self.index_shared_parts(package, target, seen)
 
     def add_content_type(self, path, content_type):
-        etree.SubElement(
+        self.override_content_types[path] = etree.SubElement(
             self.content_types.tree.getroot(),
             'Override',
             PartName=path,
@@ -58,15 +134,14 @@ class PresentationMerger(object):
         if extension in self.default_content_types:
             return
 
-        self.default_content_types.add(extension)
-        etree.SubElement(
+        self.default_content_types[extension] = etree.SubElement(
             self.content_types.tree.getroot(),
             'Default',
             Extension=extension,
             ContentType=content_type,
         )
 
-    def merge_presentation_dir(self, d, n):
+    def merge_presentation_package(self, package, n):
         slide_number = 1
 
         self.add_content_type(
@@ -88,18 +163,19 @@ class PresentationMerger(object):
             Target=path.join('slides', '%sslide%s.xml' % (n, slide_number)),
         )
 
-        content_types = etree.parse(path.join(d, '[Content_Types].xml'))
+        content_types = package.parse('[Content_Types].xml')
         for e in content_types.getroot().iter(tag='{*}Default'):
             self.add_default_content_type(e.get('Extension'), e.get('ContentType'))
+        overrides = {e.get('PartName'): e for e in content_types.getroot().iter(tag='{*}Override')}
         self.merge_related(
             path.join('ppt', 'slides', 'slide%s.xml' % slide_number),
-            d,
+            package,
             n,
             {},
-            content_types,
+            overrides,
         )
 
-    def merge_related(self, path_, d, n, merged, content_types):
+    def merge_related(self, path_, package, n, merged, overrides, rel_type=None):
         path_ = path.abspath(path.join('/', path_))
         if path_ in merged:
             return
@@ -107,58 +183,53 @@ class PresentationMerger(object):
         head, tail = path.split(path_)
         new_path = path.join(head, '%s%s' % (n, tail))
 
-        merged[path_] = new_path
+        if self.is_shared(package, path.relpath(path_, '/'), rel_type):
+            digest = self.get_digest(package, path.relpath(path_, '/'))
+            if digest in self.shared_parts:
+                merged[path_] = self.shared_parts[digest]
+                return
+            self.shared_parts[digest] = new_path
 
+        merged[path_] = new_path
 
-        try:
-            os.makedirs(path.dirname(path.join(self.main_dir, path.relpath(new_path, '/'))))
-        except OSError:
-            pass
-        shutil.copy(
-            path.join(d, path.relpath(path_, '/')),
-            path.join(self.main_dir, path.relpath(new_path, '/')),
-        )
+        self.members[path.relpath(new_path, '/')] = (package, path.relpath(path_, '/'))
 
         rels_path = path.relpath(path.join(head, '_rels', '%s.rels' % tail), '/')
-        if path.exists(path.join(d, rels_path)):
+        if rels_path in package:
             new_rels_path = path.relpath(path.join(head, '_rels', '%s%s.rels' % (n, tail)), '/')
-            non_follow_types = [
-                'http://schemas.openxmlformats.org/officeDocument/2006/relationships/slideMaster',
-                'http://schemas.openxmlformats.org/officeDocument/2006/relationships/notesMaster',
-                'http://schemas.openxmlformats.org/officeDocument/2006/relationships/slideLayout',
-                'http://schemas.openxmlformats.org/officeDocument/2006/relationships/oleObject',
-            ]
-            rels = etree.parse(path.join(d, rels_path))
+            rels = package.parse(rels_path)
             for e in rels.getroot():
-                if e.get('Type') in non_follow_types:
+                if e.get('Type') in self.non_follow_types:
                     continue
-                self.merge_related(path.join(path_, '..', e.get('Target')), d, n, merged, content_types)
+                self.merge_related(
+                    path.join(path_, '..', e.get('Target')),
+                    package,
+                    n,
+                    merged,
+                    overrides,
+                    e.get('Type'),
+                )
 
             for e in rels.getroot():
-                if e.get('Type') in non_follow_types:
+                if e.get('Type') in self.non_follow_types:
                     continue
                 new_abs_path = path.join('/', merged[path.normpath(path.join(path_, '..', e.get('Target')))])
                 ext = e.get('Target').rsplit('.', 1)[-1]
                 if ext == 'xml' or ext not in self.default_content_types:
-                    for c in content_types.getroot():
-                        if c.get('PartName') == path.abspath(path.join('/', path_, '..', e.get('Target'))):
-                            if not any(c.get('PartName') == new_abs_path for c in self.content_types.tree.getroot()):
-                                c = copy.deepcopy(c)
-                                c.set('PartName', new_abs_path)
-                                self.content_types.tree.getroot().append(c)
-                            break
-                    else:
-                        raise Exception
+                    part_name = path.abspath(path.join('/', path_, '..', e.get('Target')))
+                    if part_name not in overrides:
+                        raise Exception('Content type of %s is not found.' % part_name)
+                    if new_abs_path not in self.override_content_types:
+                        c = copy.deepcopy(overrides[part_name])
+                        c.set('PartName', new_abs_path)
+                        self.content_types.tree.getroot().append(c)
+                        self.override_content_types[new_abs_path] = c
                 e.set(
                     'Target',
                     new_abs_path,
                 )
-            try:
-                os.makedirs(path.dirname(path.join(self.main_dir, new_rels_path)))
-            except OSError:
-                pass
-            rels.write(path.join(self.main_dir, new_rels_path))
-            path.join(self.main_dir, new_rels_path)
+            self.rels.write(new_rels_path, etree.tostring(rels))
+            self.members[new_rels_path] = (self.rels, new_rels_path)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+from __future__ import unicode_literals
+
+import argparse
+import BaseHTTPServer
+import io
+import SocketServer
+import traceback
+import urlparse
+
+from data2ppt import open_workbook
+from generate import DASHBOARD_SEQUENCE, get_template_path, load_dashboard_class, warm_up
+
+PPTX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+
+
+class RenderHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Renders dashboards from posted workbooks.
+
+    POST /dashboards/<n>[?fill_empty=1&clean=1] with .xlsx body returns .pptx
+    of the dashboard, separate charts aren't exported.
+    """
+
+    def do_POST(self):
+        path, _, query = self.path.partition('?')
+        parts = path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'dashboards' or not parts[1].isdigit() or \
+                int(parts[1]) not in DASHBOARD_SEQUENCE:
+            self.send_error(404, 'Unknown dashboard %s.' % path)
+            return
+        n = int(parts[1])
+        flags = urlparse.parse_qs(query)
+
+        try:
+            workbook = open_workbook(io.BytesIO(self.rfile.read(int(self.headers.getheader('Content-Length', 0)))))
+            output = io.BytesIO()
+            load_dashboard_class(n)(
+                get_template_path(n),
+                workbook,
+                dst=output,
+                fill_empty=flags.get('fill_empty') == ['1'],
+                clean=flags.get('clean') == ['1'],
+                export_separate_charts=False,
+            )
+        except (Exception, SystemExit):
+            error = traceback.format_exc()
+            self.log_error('Dashboard %s failed:\n%s', n, error)
+            self.send_response(500)
+            self.send_header('Content-Type', 'text/plain')
+            self.end_headers()
+            self.wfile.write(error.encode('utf-8'))
+            return
+
+        data = output.getvalue()
+        self.send_response(200)
+        self.send_header('Content-Type', PPTX_CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class RenderServer(SocketServer.ForkingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Resident render service, every request is handled in a process forked
+    from the warmed-up server, so templates and dashboard classes are loaded once.
+    """
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    warm_up(DASHBOARD_SEQUENCE)
+    server = RenderServer((args.host, args.port), RenderHandler)
+    print 'Serving dashboards on http://%s:%s/dashboards/<n>' % (args.host, args.port)
+    server.serve_forever()